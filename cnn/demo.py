@@ -150,7 +150,8 @@ out_width = 1 + (in_width + 2 * conv_params['pad'] -
                  conv_params['kernel_w']) // conv_params['stride']
 inputs = np.random.uniform(size=(batch, conv_params['in_channel'], in_height, in_width))
 in_grads = np.random.uniform(size=(batch, conv_params['out_channel'], out_height, out_width))
-conv = Convolution(conv_params)
+# float64, so that the finite differences are not swamped by rounding errors
+conv = Convolution(conv_params, dtype=np.float64)
 check_grads_layer(conv, inputs, in_grads)
 
 # %% [markdown]
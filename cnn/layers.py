@@ -3,9 +3,50 @@ change log:
 - Version 1: change the out_grads of `backward` function of `ReLU` layer into inputs_grads instead of in_grads
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from utils.tools import *
 from utils.img2cols import *
+from utils.direct_conv import *
+
+# number of output pixels expanded per img2col panel in Convolution
+BLOCK_N = 256
+
+# workers splitting small layers along the batch axis, NumPy releases the GIL inside its kernels
+_NUM_WORKERS = os.cpu_count() or 1
+_POOL = ThreadPoolExecutor(max_workers=_NUM_WORKERS)
+# images with at least this many values are left to a single call (BLAS already threads large products)
+THREAD_THRESHOLD = 32 * 32 * 32
+# OpenBLAS runs a GEMM on one thread below about this many multiply-adds (m * n * k), only products
+# that small are split across _POOL, larger ones would nest BLAS threads inside the workers
+BLAS_THREAD_THRESHOLD = 65536 * 4
+
+
+def _map_batch(func, *arrays, split=True):
+    """Call func on chunks of arrays split along the batch axis, in _POOL for batches of small images
+
+    func writes its results into (slices of) the arrays it receives, chunks are views so nothing is concatenated.
+    split=False always makes a single call, e.g. when func runs products that BLAS threads by itself.
+    """
+    batch = arrays[0].shape[0]
+    num_chunks = min(_NUM_WORKERS, batch)
+    if not split or batch < 4 or num_chunks < 2 or arrays[0][0].size >= THREAD_THRESHOLD:
+        func(*arrays)
+        return
+    bounds = np.linspace(0, batch, num_chunks + 1).astype(int)
+    futures = [_POOL.submit(func, *(a[lo:hi] for a in arrays)) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    for future in futures:
+        future.result()
+
+
+def _reuse_buffer(buf, shape, dtype=np.float32):
+    """Return buf if it already has the given shape and dtype, otherwise allocate a new one"""
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+    return buf
+
 
 class Layer(object):
     """
@@ -44,22 +85,28 @@ class Layer(object):
 
 
 class FCLayer(Layer):
-    def __init__(self, in_features, out_features, name='fclayer', initializer=Guassian()):
+    def __init__(self, in_features, out_features, name='fclayer', initializer=Guassian(), dtype=np.float32):
         """Initialization
 
         # Arguments
             in_features: int, the number of inputs features
             out_features: int, the numbet of required outputs features
             initializer: Initializer class, to initialize weights
+            dtype: numpy float type of parameters and computation, np.float64 for numerical gradient checks
         """
         super(FCLayer, self).__init__(name=name)
         self.trainable = True
+        self.dtype = dtype
 
-        self.weights = initializer.initialize((in_features, out_features))
-        self.bias = np.zeros(out_features)
+        self.weights = initializer.initialize((in_features, out_features)).astype(self.dtype, copy=False)
+        self.bias = np.zeros(out_features, dtype=self.dtype)
 
-        self.w_grad = np.zeros(self.weights.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+        self.w_grad = np.zeros(self.weights.shape, dtype=self.dtype)
+        self.b_grad = np.zeros(self.bias.shape, dtype=self.dtype)
+
+        # reused outputs of forward and backward, allocated on first call or batch size change
+        self._out_buf = None
+        self._grad_buf = None
 
     def forward(self, inputs):
         """Forward pass
@@ -70,8 +117,13 @@ class FCLayer(Layer):
         # Returns
             outputs: numpy array with shape (batch, out_features)
         """
+        inputs = inputs.astype(self.dtype, copy=False)
 
-        outputs = inputs @ self.weights + self.bias
+        # np.dot(out=) needs operands of exactly self.dtype, self.weights may have been assigned directly
+        weights = self.weights.astype(self.dtype, copy=False)
+        self._out_buf = _reuse_buffer(self._out_buf, (inputs.shape[0], weights.shape[1]), dtype=self.dtype)
+        outputs = np.dot(inputs, weights, out=self._out_buf)
+        np.add(outputs, self.bias, out=outputs)
         return outputs
 
     def backward(self, in_grads, inputs):
@@ -84,9 +136,14 @@ class FCLayer(Layer):
         # Returns
             out_grads: numpy array with shape (batch, in_features), gradients to inputs
         """
-        self.w_grad = inputs.T @ in_grads
-        self.b_grad = np.sum(in_grads, axis=0)
-        out_grads = in_grads @ self.weights.T
+        inputs = inputs.astype(self.dtype, copy=False)
+        in_grads = in_grads.astype(self.dtype, copy=False)
+
+        self.w_grad = _reuse_buffer(self.w_grad, self.weights.shape, dtype=self.dtype)
+        np.dot(inputs.T, in_grads, out=self.w_grad)
+        self.b_grad = np.sum(in_grads, axis=0, dtype=self.dtype)
+        self._grad_buf = _reuse_buffer(self._grad_buf, inputs.shape, dtype=self.dtype)
+        out_grads = np.dot(in_grads, self.weights.astype(self.dtype, copy=False).T, out=self._grad_buf)
         return out_grads
 
     def update(self, params):
@@ -100,9 +157,9 @@ class FCLayer(Layer):
         """
         for k, v in params.items():
             if 'weights' in k:
-                self.weights = v
+                self.weights = v.astype(self.dtype, copy=False)
             else:
-                self.bias = v
+                self.bias = v.astype(self.dtype, copy=False)
 
     def get_params(self, prefix):
         """Return parameters (self.weights and self.bias) as well as gradients (self.w_grad and self.b_grad)
@@ -131,7 +188,7 @@ class FCLayer(Layer):
 
 
 class Convolution(Layer):
-    def __init__(self, conv_params, initializer=Guassian(), name='conv'):
+    def __init__(self, conv_params, initializer=Guassian(), name='conv', layout='NCHW', dtype=np.float32):
         """Initialization
 
         # Arguments
@@ -143,6 +200,9 @@ class Convolution(Layer):
                 'in_channel': The number of input channels.
                 'out_channel': The number of output channels.
             initializer: Initializer class, to initialize weights
+            layout: 'NCHW' or 'NHWC', the internal layout used by img2col. Inputs and outputs are always NCHW,
+                'NHWC' keeps the channels of each pixel contiguous, which suits layers with many input channels
+            dtype: numpy float type of parameters and computation, np.float64 for numerical gradient checks
         """
         super(Convolution, self).__init__(name=name)
         self.trainable = True
@@ -152,13 +212,105 @@ class Convolution(Layer):
         self.stride = conv_params['stride']
         self.in_channel = conv_params['in_channel']
         self.out_channel = conv_params['out_channel']
+        self.dtype = dtype
+        if layout not in ('NCHW', 'NHWC'):
+            raise ValueError('Layout not supported')
+        self.layout = layout
+
+        # 1x1 kernels without padding or stride are a plain matrix multiplication over channels
+        self.pointwise = self.kernel_h == 1 and self.kernel_w == 1 and self.stride == 1 and self.pad == 0
+        # 3x3 / stride 1 kernels over at most 3 input channels (e.g. the first layer) with few filters:
+        # the img2col panel dominates there, so the forward pass convolves directly instead.
+        # backward always uses img2col, its GEMMs are much faster than direct loops
+        self.direct = self.kernel_h == 3 and self.kernel_w == 3 and self.stride == 1 and \
+            self.in_channel * self.kernel_h * self.kernel_w < 32 and self.out_channel <= 64
 
         self.weights = initializer.initialize(
-            (self.out_channel, self.in_channel, self.kernel_h, self.kernel_w))
-        self.bias = np.zeros((self.out_channel))
-
-        self.w_grad = np.zeros(self.weights.shape)
-        self.b_grad = np.zeros(self.bias.shape)
+            (self.out_channel, self.in_channel, self.kernel_h, self.kernel_w)).astype(self.dtype, copy=False)
+        self.bias = np.zeros((self.out_channel), dtype=self.dtype)
+
+        self.w_grad = np.zeros(self.weights.shape, dtype=self.dtype)
+        self.b_grad = np.zeros(self.bias.shape, dtype=self.dtype)
+
+        # reused zero-padded inputs per layout, only the interior is rewritten on every call.
+        # the direct forward pads NCHW while backward pads in self.layout, they must not share a buffer
+        self._padded = {}
+        # reused img2col panel, shape (BLOCK_N, in_channel * kernel_h * kernel_w)
+        self._cols_buf = None
+        # reused GEMM outputs, shape (batch * out_height * out_width, out_channel)
+        self._gemm_buf = None
+        # reused outputs of forward, shape (batch, out_channel, out_height, out_width)
+        self._out_buf = None
+
+    @property
+    def weights(self):
+        return self._weights
+
+    @weights.setter
+    def weights(self, weights):
+        # every rebinding refreshes the cached GEMM view; the array is kept contiguous so that the view
+        # shares its memory and in-place edits of self.weights are seen as well
+        self._weights = np.ascontiguousarray(weights, dtype=self.dtype)
+        # shape (out_channel, in_channel * kernel_h * kernel_w)
+        self._weights_rows = self._weights.reshape((self.out_channel, -1))
+
+    @property
+    def bias(self):
+        return self._bias
+
+    @bias.setter
+    def bias(self, bias):
+        self._bias = np.ascontiguousarray(bias, dtype=self.dtype)
+        # shape (out_channel, 1)
+        self._bias_col = self._bias.reshape((-1, 1))
+
+    def _pointwise_split(self, pixels):
+        """Whether the per-image 1x1 products are small enough for BLAS to run single-threaded"""
+        return self.out_channel * self.in_channel * pixels < BLAS_THREAD_THRESHOLD
+
+    def _pointwise_chunk(self, inputs_rows, outputs):
+        np.matmul(self._weights_rows, inputs_rows, out=outputs)
+        np.add(outputs, self._bias_col, out=outputs)
+
+    def _pointwise_backward_chunk(self, in_grads_rows, out_grads):
+        np.matmul(self._weights_rows.T, in_grads_rows, out=out_grads)
+
+    def _pad(self, inputs, layout):
+        """Zero-pad inputs into self._padded[layout], transposed to (batch, in_height, in_width, in_channel)
+        for the 'NHWC' layout"""
+        batch, in_channel, in_height, in_width = inputs.shape
+        p = self.pad
+        if layout == 'NHWC':
+            shape = (batch, in_height + 2*p, in_width + 2*p, in_channel)
+            inputs = inputs.transpose(0, 2, 3, 1)
+            interior = (slice(None), slice(p, p + in_height), slice(p, p + in_width), slice(None))
+        else:
+            shape = (batch, in_channel, in_height + 2*p, in_width + 2*p)
+            interior = (slice(None), slice(None), slice(p, p + in_height), slice(p, p + in_width))
+
+        # the border is zeroed once on allocation and never written afterwards
+        padded = self._padded.get(layout)
+        if padded is None or padded.shape != shape:
+            padded = self._padded[layout] = np.zeros(shape, dtype=self.dtype)
+        padded[interior] = inputs
+        return padded
+
+    def _get_weights_rows(self):
+        """Convert the kernels to rows, shape (out_channel, in_channel * kernel_h * kernel_w), ordered as the img2col panel"""
+        if self.layout == 'NHWC':
+            # a copy, so it is not cached: it would go stale when self.weights is modified in place
+            return self.weights.transpose(0, 2, 3, 1).reshape((self.out_channel, -1))
+        return self._weights_rows
+
+    def _img2col(self, inputs_padded, out, row_start, out_height, out_width):
+        """Fill out with the receptive fields of output pixels row_start, ..., row_start + len(out) - 1"""
+        img2col = img2col_nhwc_nb if self.layout == 'NHWC' else img2col_rows_nb
+        return img2col(inputs_padded, out, self.kernel_h, self.kernel_w, self.stride, out_height, out_width, row_start)
+
+    def _col2img(self, cols, out_grads_padded, row_start, out_height, out_width):
+        """Accumulate the receptive field gradients of output pixels row_start, ... into out_grads_padded"""
+        col2img = col2img_nhwc_nb if self.layout == 'NHWC' else col2img_rows_nb
+        col2img(cols, out_grads_padded, self.kernel_h, self.kernel_w, self.stride, out_height, out_width, row_start)
 
     def forward(self, inputs):
         """Forward pass
@@ -169,21 +321,46 @@ class Convolution(Layer):
         # Returns
             outputs: numpy array with shape (batch, out_channel, out_height, out_width)
         """
-        batch, in_channel, in_height, in_width = inputs.shape
+        inputs = inputs.astype(self.dtype, copy=False)
 
-        out_height = (in_height + 2*self.pad - self.kernel_h) // self.stride + 1
-        out_width = (in_width + 2*self.pad - self.kernel_w) // self.stride + 1
+        if self.pointwise:
+            batch, in_channel, in_height, in_width = inputs.shape
+            self._out_buf = _reuse_buffer(self._out_buf, (batch, self.out_channel, in_height, in_width), dtype=self.dtype)
+            # one (out_channel, in_channel) x (in_channel, in_height * in_width) product per image, no img2col
+            _map_batch(self._pointwise_chunk, inputs.reshape((batch, self.in_channel, -1)),
+                       self._out_buf.reshape((batch, self.out_channel, -1)),
+                       split=self._pointwise_split(in_height * in_width))
+            return self._out_buf
 
-        # convert input image to columns, shape (in_channel * kernel_h * kernel_w, out_height * out_width * batch)
-        inputs_cols = img2col_indices(inputs, self.kernel_h, self.kernel_w, self.pad, self.stride)
-        # convert the kernels to rows, shape (out_channel, in_channel * kernel_h * kernel_w)
-        weights_rows = self.weights.reshape((self.out_channel, -1))
+        if self.direct:
+            # the direct kernel always takes NCHW
+            return direct_conv2d(self._pad(inputs, 'NCHW'), self.weights, self.bias)
 
-        outputs = weights_rows @ inputs_cols + self.bias.reshape((-1, 1))
+        batch, in_channel, in_height, in_width = inputs.shape
 
-        outputs = outputs.reshape(self.out_channel, out_height, out_width, batch)
-        outputs = outputs.transpose(3, 0, 1, 2)
-        return outputs
+        out_height = (in_height + 2*self.pad - self.kernel_h) // self.stride + 1
+        out_width = (in_width + 2*self.pad - self.kernel_w) // self.stride + 1
+        num_rows = batch * out_height * out_width
+
+        inputs_padded = self._pad(inputs, self.layout)
+        weights_rows = self._get_weights_rows()
+
+        # partial img2col: expand BLOCK_N output pixels at a time into a small panel and stream it through the GEMM
+        self._cols_buf = _reuse_buffer(self._cols_buf, (BLOCK_N, weights_rows.shape[1]), dtype=self.dtype)
+        self._gemm_buf = _reuse_buffer(self._gemm_buf, (num_rows, self.out_channel), dtype=self.dtype)
+        outputs = self._gemm_buf
+        for n0 in range(0, num_rows, BLOCK_N):
+            n1 = min(n0 + BLOCK_N, num_rows)
+            inputs_cols = self._img2col(inputs_padded, self._cols_buf[:n1 - n0], n0, out_height, out_width)
+            np.dot(inputs_cols, weights_rows.T, out=outputs[n0:n1])
+            # add the bias while the block is still in cache
+            np.add(outputs[n0:n1], self.bias, out=outputs[n0:n1])
+
+        # materialize NCHW outputs in a single pass
+        outputs = outputs.reshape(batch, out_height, out_width, self.out_channel)
+        self._out_buf = _reuse_buffer(self._out_buf, (batch, self.out_channel, out_height, out_width), dtype=self.dtype)
+        np.copyto(self._out_buf, outputs.transpose(0, 3, 1, 2))
+        return self._out_buf
 
     def backward(self, in_grads, inputs):
         """Backward pass, store gradients to self.weights into self.w_grad and store gradients to self.bias into self.b_grad
@@ -195,20 +372,50 @@ class Convolution(Layer):
         # Returns
             out_grads: numpy array with shape (batch, in_channel, in_height, in_width), gradients to inputs
         """
-        self.b_grad = np.sum(in_grads, axis=(0, 2, 3))
-
-        # convert in_grads to rows, shape (out_channel, out_height * out_width * batch)
-        in_grads_rows = in_grads.transpose(1, 2, 3, 0).reshape((self.out_channel, -1))
-        # convert input image to columns, shape (in_channel * kernel_h * kernel_w, out_height * out_width * batch)
-        inputs_cols = img2col_indices(inputs, self.kernel_h, self.kernel_w, self.pad, self.stride)
-        self.w_grad = in_grads_rows @ inputs_cols.T
-        self.w_grad = self.w_grad.reshape(self.weights.shape)
-
-        weights_rows = self.weights.reshape((self.out_channel, -1))
-        out_grads_cols = weights_rows.T @ in_grads_rows
-
-        out_grads = col2img_indices(out_grads_cols, inputs.shape, self.kernel_h, self.kernel_w, self.pad, self.stride)
+        inputs = inputs.astype(self.dtype, copy=False)
+        in_grads = in_grads.astype(self.dtype, copy=False)
+
+        if self.pointwise:
+            batch = in_grads.shape[0]
+            in_grads_rows = in_grads.reshape((batch, self.out_channel, -1))
+            self.b_grad = in_grads_rows.sum(axis=2, dtype=self.dtype).sum(axis=0)
+            inputs_rows = inputs.reshape((batch, self.in_channel, -1))
+            self.w_grad = np.tensordot(in_grads_rows, inputs_rows, axes=([0, 2], [0, 2])).reshape(self.weights.shape)
+            out_grads = np.empty(inputs.shape, dtype=self.dtype)
+            _map_batch(self._pointwise_backward_chunk, in_grads_rows, out_grads.reshape(inputs_rows.shape),
+                       split=self._pointwise_split(inputs_rows.shape[2]))
+            return out_grads
+
+        batch, _, out_height, out_width = in_grads.shape
+        num_rows = batch * out_height * out_width
+
+        # convert in_grads to rows, shape (batch * out_height * out_width, out_channel)
+        in_grads_rows = in_grads.transpose(0, 2, 3, 1).reshape((num_rows, self.out_channel))
+        self.b_grad = in_grads_rows.sum(axis=0, dtype=self.dtype)
+
+        inputs_padded = self._pad(inputs, self.layout)
+        weights_rows = self._get_weights_rows()
+
+        w_grad_rows = np.zeros(weights_rows.shape, dtype=self.dtype)
+        out_grads_padded = np.zeros(inputs_padded.shape, dtype=self.dtype)
+        self._cols_buf = _reuse_buffer(self._cols_buf, (BLOCK_N, weights_rows.shape[1]), dtype=self.dtype)
+        for n0 in range(0, num_rows, BLOCK_N):
+            n1 = min(n0 + BLOCK_N, num_rows)
+            inputs_cols = self._img2col(inputs_padded, self._cols_buf[:n1 - n0], n0, out_height, out_width)
+            w_grad_rows += in_grads_rows[n0:n1].T @ inputs_cols
+            # the panel is consumed, reuse it for the gradients to the same receptive fields
+            out_grads_cols = np.dot(in_grads_rows[n0:n1], weights_rows, out=inputs_cols)
+            self._col2img(out_grads_cols, out_grads_padded, n0, out_height, out_width)
+
+        if self.layout == 'NHWC':
+            w_grad_rows = w_grad_rows.reshape(self.out_channel, self.kernel_h, self.kernel_w, self.in_channel)
+            self.w_grad = np.ascontiguousarray(w_grad_rows.transpose(0, 3, 1, 2))
+            out_grads_padded = out_grads_padded.transpose(0, 3, 1, 2)
+        else:
+            self.w_grad = w_grad_rows.reshape(self.weights.shape)
 
+        in_height, in_width = inputs.shape[2], inputs.shape[3]
+        out_grads = out_grads_padded[:, :, self.pad:self.pad + in_height, self.pad:self.pad + in_width]
         return out_grads
 
     def update(self, params):
@@ -222,9 +429,9 @@ class Convolution(Layer):
         """
         for k, v in params.items():
             if 'weights' in k:
-                self.weights = v
+                self.weights = v.astype(self.dtype, copy=False)
             else:
-                self.bias = v
+                self.bias = v.astype(self.dtype, copy=False)
 
     def get_params(self, prefix):
         """Return parameters (self.weights and self.bias) as well as gradients (self.w_grad and self.b_grad)
@@ -257,6 +464,10 @@ class ReLU(Layer):
         """Initialization
         """
         super(ReLU, self).__init__(name=name)
+        self.mask = None
+        # reused outputs of forward and backward, allocated on first call or shape change
+        self._out_buf = None
+        self._grad_buf = None
 
     def forward(self, inputs):
         """Forward pass
@@ -267,7 +478,10 @@ class ReLU(Layer):
         # Returns
             outputs: numpy array
         """
-        outputs = np.maximum(0, inputs)
+        # keep the indicator for backward, so inputs need not be compared again
+        self.mask = np.greater_equal(inputs, 0, out=_reuse_buffer(self.mask, inputs.shape, dtype=bool))
+        self._out_buf = _reuse_buffer(self._out_buf, inputs.shape, dtype=inputs.dtype)
+        outputs = np.maximum(inputs, 0, out=self._out_buf)
         return outputs
 
     def backward(self, in_grads, inputs):
@@ -280,7 +494,10 @@ class ReLU(Layer):
         # Returns
             out_grads: numpy array, gradients to inputs 
         """
-        inputs_grads = (inputs >= 0) * in_grads
+        self._grad_buf = _reuse_buffer(self._grad_buf, in_grads.shape, dtype=in_grads.dtype)
+        # fall back to comparing inputs if forward has not cached a matching mask
+        mask = self.mask if self.mask is not None and self.mask.shape == inputs.shape else inputs >= 0
+        inputs_grads = np.multiply(in_grads, mask, out=self._grad_buf)
         out_grads = inputs_grads
         return out_grads
 
@@ -296,7 +513,7 @@ class Pooling(Layer):
                 'pool_h': The height of pooling kernel.
                 'pool_w': The width of pooling kernel.
                 'stride': The number of pixels between adjacent receptive fields in the horizontal and vertical directions.
-                'pad': The number of pixels that will be used to zero-pad the input in each x-y direction. Here, pad=2 means a 2-pixel border of padding with zeros.
+                'pad': Must be 0, padding is not implemented yet and any other value raises ValueError.
         """
         super(Pooling, self).__init__(name=name)
         self.pool_type = pool_params['pool_type']
@@ -304,8 +521,57 @@ class Pooling(Layer):
         self.pool_width = pool_params['pool_width']
         self.stride = pool_params['stride']
         self.pad = pool_params['pad']
+        if self.pad != 0:
+            raise ValueError('Padding is not supported')
 
         self.max_idx = None
+        # reused img2col outputs
+        self._cols_buf = None
+
+    def _get_cols(self, inputs):
+        """Convert inputs to columns, shape (pool_height * pool_width, out_height * out_width * batch * in_channel)"""
+        self._cols_buf = img2col_fast(inputs, self.pool_height, self.pool_width, self.pad, self.stride,
+                                      out=self._cols_buf)
+        return self._cols_buf
+
+    def _max_forward(self, inputs):
+        """Max pooling as a windowed reduction on strided views of inputs, keeping the argmax of every window"""
+        batch, in_channel, in_height, in_width = inputs.shape
+        out_height = (in_height - self.pool_height) // self.stride + 1
+        out_width = (in_width - self.pool_width) // self.stride + 1
+
+        outputs = np.empty((batch, in_channel, out_height, out_width), dtype=inputs.dtype)
+        idx_dtype = np.uint8 if self.pool_height * self.pool_width <= 256 else np.uint16
+        self.max_idx = np.empty(outputs.shape, dtype=idx_dtype)
+        _map_batch(self._max_forward_chunk, inputs, outputs, self.max_idx)
+        return outputs
+
+    def _max_forward_chunk(self, inputs, outputs, max_idx):
+        # shape (batch, in_channel, out_height, out_width, pool_height, pool_width), no data is copied
+        windows = np.lib.stride_tricks.sliding_window_view(inputs, (self.pool_height, self.pool_width), axis=(2, 3))
+        windows = windows[:, :, ::self.stride, ::self.stride]
+
+        np.copyto(outputs, windows[..., 0, 0])
+        max_idx.fill(0)
+        for k in range(1, self.pool_height * self.pool_width):
+            candidates = windows[..., k // self.pool_width, k % self.pool_width]
+            # strict comparison keeps the first maximum, same as np.argmax
+            larger = candidates > outputs
+            np.copyto(outputs, candidates, where=larger)
+            np.copyto(max_idx, k, where=larger)
+
+    def _max_backward(self, in_grads, inputs):
+        """Route in_grads to the argmax of every window, one strided scatter per position in the window"""
+        out_grads = np.zeros(inputs.shape, dtype=in_grads.dtype)
+        _map_batch(self._max_backward_chunk, in_grads, self.max_idx, out_grads)
+        return out_grads
+
+    def _max_backward_chunk(self, in_grads, max_idx, out_grads):
+        out_height, out_width = in_grads.shape[2], in_grads.shape[3]
+        for k in range(self.pool_height * self.pool_width):
+            i, j = k // self.pool_width, k % self.pool_width
+            out_grads[:, :, i:i + self.stride * out_height:self.stride, j:j + self.stride * out_width:self.stride] += \
+                np.where(max_idx == k, in_grads, 0)
 
     def forward(self, inputs):
         """Forward pass
@@ -316,12 +582,9 @@ class Pooling(Layer):
         # Returns
             outputs: numpy array with shape (batch, in_channel, out_height, out_width)
         """
-        pool_func = None
         if self.pool_type == 'max':
-            pool_func = maxpool
-        elif self.pool_type == 'avg':
-            pool_func = avgpool
-        else:
+            return self._max_forward(inputs)
+        elif self.pool_type != 'avg':
             raise ValueError('Pool type not supported')
 
         batch, in_channel, in_height, in_width = inputs.shape
@@ -331,9 +594,9 @@ class Pooling(Layer):
 
         # make inputs.shape same as convolution operation
         inputs_reshaped = inputs.reshape((batch * in_channel, 1, in_height, in_width))
-        inputs_cols = img2col_indices(inputs_reshaped, self.pool_height, self.pool_width, self.pad, self.stride)
+        inputs_cols = self._get_cols(inputs_reshaped)
 
-        outputs, self.max_idx = pool_func(inputs_cols)
+        outputs, _ = avgpool(inputs_cols)
 
         outputs = outputs.reshape(out_height, out_width, batch, in_channel)
         outputs = outputs.transpose(2, 3, 0, 1)
@@ -350,26 +613,23 @@ class Pooling(Layer):
         # Returns
             out_grads: numpy array with shape (batch, in_channel, in_height, in_width), gradients to inputs
         """
-        dpool_func = None
         if self.pool_type == 'max':
-            dpool_func = dmaxpool
-        elif self.pool_type == 'avg':
-            dpool_func = davgpool
-        else:
+            return self._max_backward(in_grads, inputs)
+        elif self.pool_type != 'avg':
             raise ValueError('Pool type is not supported')
 
         batch, in_channel, in_height, in_width = inputs.shape
 
         # make inputs.shape same as convolution operation
         inputs_reshaped = inputs.reshape(batch * in_channel, 1, in_height, in_width)
-        inputs_cols = img2col_indices(inputs_reshaped, self.pool_height, self.pool_width, self.pad, self.stride)
+        inputs_cols = self._get_cols(inputs_reshaped)
 
         out_grads_cols = np.zeros_like(inputs_cols)
         in_grads_cols = in_grads.transpose(2, 3, 0, 1).ravel()
 
-        out_grads = dpool_func(out_grads_cols, in_grads_cols, self.max_idx)
+        davgpool(out_grads_cols, in_grads_cols, None)
 
-        out_grads = col2img_indices(out_grads_cols, (batch * in_channel, 1, in_height, in_width), self.pool_height, self.pool_width, self.pad, self.stride)
+        out_grads = col2img_fast(out_grads_cols, inputs_reshaped.shape, self.pool_height, self.pool_width, self.pad, self.stride)
         out_grads = out_grads.reshape(inputs.shape)
 
         return out_grads
@@ -386,6 +646,7 @@ class Dropout(Layer):
         self.ratio = ratio
         self.mask = None
         self.seed = seed
+        self._rng = np.random.default_rng(seed)
 
     def forward(self, inputs):
         """Forward pass (Hint: use self.training to decide the phrase/mode of the model)
@@ -397,12 +658,15 @@ class Dropout(Layer):
             outputs: numpy array
         """
         if self.training:
-            if self.seed is not None:
-                np.random.seed(self.seed)
-            self.mask = np.random.binomial(1, 1-self.ratio, size=inputs.shape) / (1-self.ratio)
+            # a fixed seed gives the same mask on every call
+            rng = np.random.default_rng(self.seed) if self.seed is not None else self._rng
+            keep = rng.random(inputs.shape, dtype=np.float32) >= self.ratio
+            # fold the 1/(1-ratio) scale into the mask once
+            self.mask = np.multiply(keep, 1. / (1 - self.ratio), dtype=np.float32)
             outputs = inputs * self.mask
         else:
-            self.mask = np.ones(inputs.shape)
+            # no mask is needed for inference
+            self.mask = None
             outputs = inputs
         return outputs
 
@@ -417,6 +681,8 @@ class Dropout(Layer):
         # Returns
             out_grads: numpy array, gradients to inputs 
         """
+        if self.mask is None:
+            return in_grads
         out_grads = in_grads * self.mask
         return out_grads
 
@@ -437,7 +703,8 @@ class Flatten(Layer):
             outputs: numpy array with shape (batch, in_channel*in_height*in_width)
         """
         batch = inputs.shape[0]
-        outputs = inputs.copy().reshape(batch, -1)
+        # a view for contiguous inputs, reshape only copies when it has to
+        outputs = inputs.reshape(batch, -1)
         return outputs
 
     def backward(self, in_grads, inputs):
@@ -450,5 +717,5 @@ class Flatten(Layer):
         # Returns
             out_grads: numpy array with shape (batch, in_channel, in_height, in_width), gradients to inputs 
         """
-        out_grads = in_grads.copy().reshape(inputs.shape)
+        out_grads = in_grads.reshape(inputs.shape)
         return out_grads
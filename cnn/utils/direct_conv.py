@@ -0,0 +1,40 @@
+import numpy as np
+from numba import njit, prange
+
+# Direct forward convolution for 3x3 / stride 1 layers with very few input channels,
+# where building the im2col panel costs more than the tiny GEMM it feeds.
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _direct_conv2d_3x3(x_padded, weights, bias, out_height, out_width):
+    N, C = x_padded.shape[0], x_padded.shape[1]
+    F = weights.shape[0]
+    out = np.empty((N, F, out_height, out_width), dtype=x_padded.dtype)
+    for nf in prange(N * F):
+        n = nf // F
+        f = nf % F
+        out[n, f] = bias[f]
+        for c in range(C):
+            w00, w01, w02 = weights[f, c, 0, 0], weights[f, c, 0, 1], weights[f, c, 0, 2]
+            w10, w11, w12 = weights[f, c, 1, 0], weights[f, c, 1, 1], weights[f, c, 1, 2]
+            w20, w21, w22 = weights[f, c, 2, 0], weights[f, c, 2, 1], weights[f, c, 2, 2]
+            x = x_padded[n, c]
+            for i in range(out_height):
+                for j in range(out_width):
+                    out[n, f, i, j] += (w00 * x[i, j] + w01 * x[i, j + 1] + w02 * x[i, j + 2]
+                                        + w10 * x[i + 1, j] + w11 * x[i + 1, j + 1] + w12 * x[i + 1, j + 2]
+                                        + w20 * x[i + 2, j] + w21 * x[i + 2, j + 1] + w22 * x[i + 2, j + 2])
+    return out
+
+
+def direct_conv2d(x_padded, weights, bias):
+    # stride 1 only
+    F, _, HH, WW = weights.shape
+    if HH != 3 or WW != 3:
+        raise ValueError('Direct convolution only supports 3x3 kernels')
+    out_height = x_padded.shape[2] - 2
+    out_width = x_padded.shape[3] - 2
+    weights = np.ascontiguousarray(weights, dtype=x_padded.dtype)
+    bias = np.ascontiguousarray(bias, dtype=x_padded.dtype)
+    return _direct_conv2d_3x3(x_padded, weights, bias, out_height, out_width)
+
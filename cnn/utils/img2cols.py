@@ -1,57 +1,151 @@
 import numpy as np
+from numba import njit, prange
+
+# number of images accumulated per col2img_nb task
+COL2IMG_BLOCK = 32
+
+@njit(parallel=True, cache=True)
+def img2col_nb(x_padded, out, kernel_height, kernel_width, stride, out_height, out_width):
+    # row (c, kh, kw), column (oh, ow, n);
+    # one read per input pixel and contiguous writes along each row
+    N, C = x_padded.shape[0], x_padded.shape[1]
+    rows = C * kernel_height * kernel_width
+    for p in prange(rows * out_height):
+        row = p // out_height
+        oh = p % out_height
+        c = row // (kernel_height * kernel_width)
+        kh = (row // kernel_width) % kernel_height
+        kw = row % kernel_width
+        h = oh * stride + kh
+        col = oh * out_width * N
+        for ow in range(out_width):
+            w = ow * stride + kw
+            for n in range(N):
+                out[row, col] = x_padded[n, c, h, w]
+                col += 1
+    return out
+
+def img2col_fast(x, kernel_height, kernel_width, padding, stride, out=None):
+    N, C, H, W = x.shape
+    out_height = (H + 2 * padding - kernel_height) // stride + 1
+    out_width = (W + 2 * padding - kernel_width) // stride + 1
+    shape = (C * kernel_height * kernel_width, out_height * out_width * N)
+    if out is None or out.shape != shape or out.dtype != x.dtype:
+        out = np.empty(shape, dtype=x.dtype)
 
-def get_img2col_indices(x_shape, kernel_height, kernel_width, padding, stride):
-    N, C, H, W = x_shape
-
-    out_height = int((H + 2 * padding - kernel_height) / stride + 1)
-    out_width = int((W + 2 * padding - kernel_width) / stride + 1)
-
-    i0 = np.repeat(np.arange(kernel_height), kernel_width)
-    i0 = np.tile(i0, C)
-    i1 = stride * np.repeat(np.arange(out_height), out_width)
-    j0 = np.tile(np.arange(kernel_width), kernel_height * C)
-    j1 = stride * np.tile(np.arange(out_width), out_height)
-    i = i0.reshape(-1, 1) + i1.reshape(1, -1)
-    j = j0.reshape(-1, 1) + j1.reshape(1, -1)
-
-    k = np.repeat(np.arange(C), kernel_height * kernel_width).reshape(-1, 1)
-
-    return k.astype(int), i.astype(int), j.astype(int)
-
-def img2col_indices(x, kernel_height, kernel_width, padding, stride):
     x_padded = np.pad(x, ((0, 0), (0, 0), (padding, padding), (padding, padding)), mode='constant')
-
-    k, i, j = get_img2col_indices(x.shape, kernel_height, kernel_width, padding, stride)
-
-    cols = x_padded[:, k, i, j]
-    C = x.shape[1]
-    cols = cols.transpose(1, 2, 0).reshape(kernel_height * kernel_width * C, -1)
-    return cols
-
-def col2img_indices(cols, x_shape, kernel_height, kernel_width, padding,
-                    stride):
+    return img2col_nb(x_padded, out, kernel_height, kernel_width, stride, out_height, out_width)
+
+@njit(parallel=True, cache=True)
+def img2col_rows_nb(x_padded, out, kernel_height, kernel_width, stride, out_height, out_width, row_start):
+    # row (n, oh, ow), column (c, kh, kw), for the len(out) output pixels from row_start on
+    C = x_padded.shape[1]
+    for r in prange(out.shape[0]):
+        p = row_start + r
+        n = p // (out_height * out_width)
+        oh = (p // out_width) % out_height
+        ow = p % out_width
+        col = 0
+        for c in range(C):
+            for kh in range(kernel_height):
+                h = oh * stride + kh
+                for w in range(ow * stride, ow * stride + kernel_width):
+                    out[r, col] = x_padded[n, c, h, w]
+                    col += 1
+    return out
+
+@njit(parallel=True, cache=True)
+def img2col_nhwc_nb(x_padded, out, kernel_height, kernel_width, stride, out_height, out_width, row_start):
+    # row (n, oh, ow), column (kh, kw, c): with channels last, each kernel row
+    # is a run of kernel_width * C contiguous values
+    C = x_padded.shape[3]
+    for r in prange(out.shape[0]):
+        p = row_start + r
+        n = p // (out_height * out_width)
+        oh = (p // out_width) % out_height
+        ow = p % out_width
+        col = 0
+        for kh in range(kernel_height):
+            h = oh * stride + kh
+            for w in range(ow * stride, ow * stride + kernel_width):
+                for c in range(C):
+                    out[r, col] = x_padded[n, h, w, c]
+                    col += 1
+    return out
+
+@njit(cache=True)
+def col2img_rows_nb(cols, x_padded, kernel_height, kernel_width, stride, out_height, out_width, row_start):
+    # inverse of img2col_rows_nb, accumulating overlapping receptive fields
+    C = x_padded.shape[1]
+    for r in range(cols.shape[0]):
+        p = row_start + r
+        n = p // (out_height * out_width)
+        oh = (p // out_width) % out_height
+        ow = p % out_width
+        col = 0
+        for c in range(C):
+            for kh in range(kernel_height):
+                h = oh * stride + kh
+                for w in range(ow * stride, ow * stride + kernel_width):
+                    x_padded[n, c, h, w] += cols[r, col]
+                    col += 1
+    return x_padded
+
+@njit(cache=True)
+def col2img_nhwc_nb(cols, x_padded, kernel_height, kernel_width, stride, out_height, out_width, row_start):
+    # inverse of img2col_nhwc_nb, accumulating overlapping receptive fields
+    C = x_padded.shape[3]
+    for r in range(cols.shape[0]):
+        p = row_start + r
+        n = p // (out_height * out_width)
+        oh = (p // out_width) % out_height
+        ow = p % out_width
+        col = 0
+        for kh in range(kernel_height):
+            h = oh * stride + kh
+            for w in range(ow * stride, ow * stride + kernel_width):
+                for c in range(C):
+                    x_padded[n, h, w, c] += cols[r, col]
+                    col += 1
+    return x_padded
+
+@njit(parallel=True, cache=True)
+def col2img_nb(cols, x_padded, kernel_height, kernel_width, stride, out_height, out_width, block):
+    # inverse of img2col_nb as a scatter in column order: each task owns one channel of up to block
+    # images, so the innermost loop reads contiguous columns and tasks never write the same pixel
+    N, C, H_padded, W_padded = x_padded.shape
+    num_blocks = (N + block - 1) // block
+    for t in prange(C * num_blocks):
+        c = t // num_blocks
+        n0 = (t % num_blocks) * block
+        nb = min(block, N - n0)
+        # (h, w, n) so that the accumulation matches the column order
+        acc = np.zeros((H_padded, W_padded, nb), dtype=x_padded.dtype)
+        for kh in range(kernel_height):
+            for kw in range(kernel_width):
+                row = (c * kernel_height + kh) * kernel_width + kw
+                for oh in range(out_height):
+                    h = oh * stride + kh
+                    col = oh * out_width * N + n0
+                    for ow in range(out_width):
+                        w = ow * stride + kw
+                        for n in range(nb):
+                            acc[h, w, n] += cols[row, col + n]
+                        col += N
+        for n in range(nb):
+            for h in range(H_padded):
+                for w in range(W_padded):
+                    x_padded[n0 + n, c, h, w] = acc[h, w, n]
+    return x_padded
+
+def col2img_fast(cols, x_shape, kernel_height, kernel_width, padding, stride):
     N, C, H, W = x_shape
+    out_height = (H + 2 * padding - kernel_height) // stride + 1
+    out_width = (W + 2 * padding - kernel_width) // stride + 1
 
-    H_padded, W_padded = H + 2 * padding, W + 2 * padding
-    x_padded = np.zeros((N, C, H_padded, W_padded), dtype=cols.dtype)
-
-    k, i, j = get_img2col_indices(x_shape, kernel_height, kernel_width, padding, stride)
-    cols_reshaped = cols.reshape(C * kernel_height * kernel_width, -1, N)
-    cols_reshaped = cols_reshaped.transpose(2, 0, 1)
-    np.add.at(x_padded, (slice(None), k, i, j), cols_reshaped)
-
-    if padding == 0:
-        return x_padded
-    return x_padded[:, :, padding:-padding, padding:-padding]
-
-def maxpool(X_col):
-    max_idx = np.argmax(X_col, axis=0)
-    out = X_col[max_idx, range(max_idx.size)]
-    return out, max_idx
-
-def dmaxpool(dX_col, dout_col, max_idx):
-    dX_col[max_idx, range(dout_col.size)] = dout_col
-    return dX_col
+    x_padded = np.empty((N, C, H + 2 * padding, W + 2 * padding), dtype=cols.dtype)
+    col2img_nb(cols, x_padded, kernel_height, kernel_width, stride, out_height, out_width, COL2IMG_BLOCK)
+    return x_padded[:, :, padding:padding + H, padding:padding + W]
 
 def avgpool(X_col):
     out = np.mean(X_col, axis=0)
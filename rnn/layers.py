@@ -69,9 +69,9 @@ class FCLayer(Layer):
         # Returns
             outputs: numpy array with shape (batch, ..., out_features)
         """
-        batch = inputs.shape[0]
-        b_reshaped = self.bias.reshape((1,)*(inputs.ndim-1)+self.bias.shape)
-        outputs = np.dot(inputs, self.weights)+b_reshaped
+        outputs = np.dot(inputs, self.weights)
+        # add the bias in place, broadcasting over all leading axes
+        np.add(outputs, self.bias, out=outputs)
         return outputs
 
     def backward(self, in_grads, inputs):
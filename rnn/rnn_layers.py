@@ -35,11 +35,10 @@ class RNNCell(Layer):
         # Returns
             outputs: numpy array with shape (batch, units)
         """
-        batch = len(inputs[0])
-        inputs[0] @ self.kernel
-        inputs[1] @ self.recurrent_kernel
-        a_t = inputs[0] @ self.kernel + inputs[1] @ self.recurrent_kernel + np.repeat(self.bias.reshape((1, -1)), batch, axis=0)
-        return np.tanh(a_t)
+        a_t = inputs[0] @ self.kernel
+        np.add(a_t, inputs[1] @ self.recurrent_kernel, out=a_t)
+        np.add(a_t, self.bias, out=a_t)
+        return np.tanh(a_t, out=a_t)
 
     def backward(self, in_grads, inputs):
         """